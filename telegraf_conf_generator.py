@@ -1,8 +1,13 @@
 import csv
+import itertools
 import logging
 import os
+import re
 import time
-from typing import List, Dict, Any
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+from typing import List, Dict, Any, Callable, Iterator, Tuple
 
 # Configure logging (initial setup, level might be overridden in main)
 logging.basicConfig(
@@ -20,6 +25,75 @@ MQTT_TOPIC_EXCLUSION_CHARS = [
     "$"     # When used at start of topic - reserved for server implementation
 ]
 
+# Translation table replacing every excluded character with '_' in one pass
+_SANITIZE_TABLE = str.maketrans({char: '_' for char in MQTT_TOPIC_EXCLUSION_CHARS})
+
+# MQTT topic limits (per Solace docs)
+_MAX_TOPIC_BYTES = 250
+_MAX_TOPIC_LEVELS = 128
+
+# Prefix of every generated MQTT topic, followed by the node's custom name
+_TOPIC_PREFIX = "telegraf/opcua/"
+
+# Topic limits left for the custom name after the prefix
+_TOPIC_NAME_MAX_BYTES = _MAX_TOPIC_BYTES - len(_TOPIC_PREFIX)
+_TOPIC_NAME_SEPARATOR_LIMIT = _MAX_TOPIC_LEVELS - _TOPIC_PREFIX.count('/')
+
+# Fast gate for the common case: a short, plain ASCII custom name that needs no
+# sanitization (only the level count still has to be checked)
+_CLEAN_TOPIC_NAME_MATCH = re.compile(
+    r'\A[A-Za-z0-9_./:\-]{0,%d}\Z' % _TOPIC_NAME_MAX_BYTES).match
+
+# Number of CSV rows rendered per chunk (the unit of work for worker processes)
+_ROWS_PER_CHUNK = 10000
+
+# Per-node config templates, filled with %-formatting for every node
+_NODE_TPL = """  [[inputs.opcua.nodes]]
+    name = "%s"
+    namespace = "%s"
+    identifier_type = "%s"
+    identifier = '''%s'''
+"""
+
+_MQTT_TPL = '''# MQTT Output for Node: %s
+[[outputs.mqtt]]
+  servers = ["%s"]
+  topic = "''' + _TOPIC_PREFIX + '''%s"
+  tagpass = { id = ["ns=%s;s=%s"] }
+  qos = 0
+  retain = false
+  data_format = "template"
+  template = "{{ .Field \\"%s\\" }}"
+'''
+
+@lru_cache(maxsize=None)
+def ensure_mqtt_topic(topic_name: str) -> Tuple[str, bool]:
+    """
+    Validates and, if needed, sanitizes an MQTT topic in a single pass.
+    Returns the topic to use and whether it had to be sanitized.
+    Results are cached, since CSV exports often repeat the same names.
+    """
+    sanitized_name = topic_name.translate(_SANITIZE_TABLE)
+    
+    # An unchanged translation means no restricted characters (including
+    # any leading $, which is reserved for system topics), so only the
+    # length and level limits remain. For ASCII topics the character count
+    # equals the UTF-8 byte count.
+    if (sanitized_name == topic_name
+            and len(topic_name) <= _MAX_TOPIC_BYTES
+            and (topic_name.isascii() or len(topic_name.encode('utf-8')) <= _MAX_TOPIC_BYTES)
+            and topic_name.count('/') < _MAX_TOPIC_LEVELS):
+        return topic_name, False
+    
+    return sanitized_name, True
+
+def _init_worker(log_level: int) -> None:
+    """
+    Applies the parent's log level in a worker process. Workers started with
+    the spawn method re-import this module and only get the default logging setup.
+    """
+    logger.setLevel(log_level)
+
 class TelegrafConfigGenerator:
     """
     Generates Telegraf configuration for OPC UA nodes from a CSV file,
@@ -31,18 +105,22 @@ class TelegrafConfigGenerator:
                  output_file_path: str, 
                  mqtt_broker: str = "tcp://mosquitto:1883",
                  opcua_endpoint: str = "opc.tcp://100.94.111.58:4841",
-                 influxdb_url: str = "http://64.226.126.250:8086"):
+                 influxdb_url: str = "http://64.226.126.250:8086",
+                 workers: int = 1):
         
         if not csv_file_path:
             raise ValueError("CSV file path cannot be empty.")
         if not output_file_path:
             raise ValueError("Output file path cannot be empty.")
+        if workers < 1:
+            raise ValueError("Number of workers must be at least 1.")
             
         self.csv_file_path = csv_file_path
         self.output_file_path = output_file_path
         self.mqtt_broker = mqtt_broker
         self.opcua_endpoint = opcua_endpoint
         self.influxdb_url = influxdb_url
+        self.workers = workers
         self._start_time = 0.0
         self._total_nodes_processed = 0
         self._topics_sanitized = 0
@@ -52,109 +130,141 @@ class TelegrafConfigGenerator:
         Validates an MQTT topic name against character restrictions.
         Returns True if valid, False otherwise.
         """
-        # Check for reserved characters
-        if any(char in topic_name for char in MQTT_TOPIC_EXCLUSION_CHARS):
-            return False
-        
-        # Check for leading $ (allowed only for system topics)
-        if topic_name.startswith("$") and not (
-            topic_name.startswith("$SYS/") or 
-            topic_name.startswith("$share/") or
-            topic_name.startswith("$noexport/")
-        ):
-            return False
-        
-        # Check length restriction (250 bytes max per Solace docs)
-        if len(topic_name.encode('utf-8')) > 250:
-            return False
-        
-        # Check for level count restriction (128 levels max per Solace docs)
-        if len(topic_name.split('/')) > 128:
-            return False
-            
-        return True
+        return not ensure_mqtt_topic(topic_name)[1]
     
     def sanitize_mqtt_topic(self, topic_name: str) -> str:
         """
         Sanitizes an MQTT topic name by replacing restricted characters.
         """
-        # Replace restricted characters
-        sanitized_name = topic_name
-        for char in MQTT_TOPIC_EXCLUSION_CHARS:
-            sanitized_name = sanitized_name.replace(char, '_')
+        return ensure_mqtt_topic(topic_name)[0]
+    
+    def _render_rows(self, rows: List[List[str]], node_id_index: int,
+                     custom_name_index: int) -> Tuple[List[str], List[str], int, int]:
+        """
+        Renders the OPC UA node blocks and MQTT output blocks for a chunk of CSV rows.
+        Returns both lists of config blocks with the number of nodes processed and
+        MQTT topics sanitized, so chunks can also be rendered in worker processes.
+        """
+        min_row_length = max(node_id_index, custom_name_index) + 1
+        opcua_blocks = []
+        mqtt_blocks = []
         
-        # Handle leading $ if not a system topic
-        if sanitized_name.startswith("$") and not (
-            sanitized_name.startswith("$SYS/") or 
-            sanitized_name.startswith("$share/") or
-            sanitized_name.startswith("$noexport/")
-        ):
-            sanitized_name = "_" + sanitized_name[1:]
+        # Bind hot-loop lookups to locals and count locally to keep
+        # per-row attribute access out of the interpreter loop
+        ensure_topic = ensure_mqtt_topic
+        clean_topic_name_match = _CLEAN_TOPIC_NAME_MATCH
+        prefix_length = len(_TOPIC_PREFIX)
+        append_node = opcua_blocks.append
+        append_mqtt = mqtt_blocks.append
+        mqtt_broker = self.mqtt_broker
+        nodes_processed = 0
+        topics_sanitized = 0
+        
+        for row in rows:
+            if len(row) < min_row_length:
+                # Blank lines are skipped silently
+                if row:
+                    logger.warning("Row missing required columns: %s", row)
+                continue
+            node_id = row[node_id_index]
+            mqtt_custom_name = row[custom_name_index]
+            
+            # Extract namespace and identifier from NodeId
+            namespace_part, separator, identifier_part = node_id.partition(';')
+            if not separator:
+                logger.warning("Skipping invalid NodeId format: %s", node_id)
+                continue
+            
+            namespace = namespace_part.removeprefix('ns=')
+            identifier = identifier_part.removeprefix('s=')
             
-        return sanitized_name
+            # Validate/sanitize the MQTT topic generated from the MQTTCustomName. The
+            # constant prefix is part of the template, so only the name part is kept.
+            topic_name = mqtt_custom_name
+            if (clean_topic_name_match(topic_name) is None
+                    or topic_name.count('/') >= _TOPIC_NAME_SEPARATOR_LIMIT):
+                original_topic = _TOPIC_PREFIX + topic_name
+                mqtt_topic, was_sanitized = ensure_topic(original_topic)
+                if was_sanitized:
+                    # The prefix has no restricted characters and is left unchanged
+                    topic_name = mqtt_topic[prefix_length:]
+                    topics_sanitized += 1
+                    logger.warning("MQTT topic '%s' contains restricted characters. "
+                                   "Using sanitized topic: '%s'", original_topic, mqtt_topic)
+            
+            # Identifier type 's': assuming all are string type as per example
+            append_node(_NODE_TPL % (mqtt_custom_name, namespace, 's', identifier))
+            append_mqtt(_MQTT_TPL % (identifier, mqtt_broker, topic_name,
+                                     namespace, identifier, mqtt_custom_name))
+            nodes_processed += 1
+        
+        return opcua_blocks, mqtt_blocks, nodes_processed, topics_sanitized
+    
+    def _render_chunks(self, chunks: Iterator[List[List[str]]],
+                       render_rows: Callable[[List[List[str]]], Tuple[List[str], List[str], int, int]]
+                       ) -> Iterator[Tuple[List[str], List[str], int, int]]:
+        """
+        Renders chunks of CSV rows, yielding results in chunk order as they complete.
+        With more than one worker, chunks are rendered in worker processes, keeping
+        at most two chunks per worker in flight to bound memory use.
+        """
+        if self.workers == 1:
+            yield from map(render_rows, chunks)
+            return
+        
+        logger.info(f"Rendering nodes with {self.workers} worker processes")
+        max_in_flight = 2 * self.workers
+        with ProcessPoolExecutor(max_workers=self.workers,
+                                 initializer=_init_worker,
+                                 initargs=(logger.getEffectiveLevel(),)) as executor:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(executor.submit(render_rows, chunk))
+                if len(pending) >= max_in_flight:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
     
     def generate_telegraf_config(self) -> None:
         """
         Process the CSV file of OPC UA nodes and generate a Telegraf configuration
         with proper MQTT topic validation/sanitization and InfluxDB output settings.
         """
-        # Check if CSV file exists
-        if not os.path.exists(self.csv_file_path):
+        try:
+            csvfile = open(self.csv_file_path, 'r', encoding='utf-8', newline='', buffering=1 << 20)
+        except FileNotFoundError:
             logger.error(f"Error: CSV file '{self.csv_file_path}' not found.")
             return
-        
-        # Read nodes from CSV file
-        nodes = []
-        try:
-            logger.info(f"Reading nodes from CSV file: {self.csv_file_path}")
-            with open(self.csv_file_path, 'r', encoding='utf-8') as csvfile:
-                reader = csv.DictReader(csvfile)
-                for row in reader:
-                    # Ensure required columns exist
-                    if all(key in row for key in ['NodeId', 'MQTTCustomName']):
-                        # Extract namespace and identifier from NodeId
-                        node_id_parts = row['NodeId'].split(';')
-                        if len(node_id_parts) != 2:
-                            logger.warning(f"Skipping invalid NodeId format: {row['NodeId']}")
-                            continue
-                        
-                        namespace = node_id_parts[0].replace('ns=', '')
-                        identifier = node_id_parts[1].replace('s=', '')
-                        mqtt_custom_name = row['MQTTCustomName']
-                        
-                        # Generate MQTT topic name using the MQTTCustomName and validate/sanitize it
-                        mqtt_topic = f"telegraf/opcua/{mqtt_custom_name}"
-                        if not self.validate_mqtt_topic(mqtt_topic):
-                            original_topic = mqtt_topic
-                            mqtt_topic = self.sanitize_mqtt_topic(mqtt_topic)
-                            self._topics_sanitized += 1
-                            logger.warning(f"MQTT topic '{original_topic}' contains restricted characters. "
-                                          f"Using sanitized topic: '{mqtt_topic}'")
-                        
-                        nodes.append({
-                            'node_id': row['NodeId'],
-                            'mqtt_custom_name': mqtt_custom_name,
-                            'namespace': namespace,
-                            'identifier': identifier,
-                            'identifier_type': 's',  # Assuming all are string type as per example
-                            'mqtt_topic': mqtt_topic
-                        })
-                        self._total_nodes_processed += 1
-                    else:
-                        logger.warning(f"Row missing required columns: {row}")
-            
-            logger.info(f"Successfully processed {self._total_nodes_processed} nodes from CSV.")
-            logger.info(f"Sanitized {self._topics_sanitized} MQTT topics with restricted characters.")
-            
-        except Exception as e:
+        except OSError as e:
             logger.error(f"Error reading CSV file: {e}", exc_info=True)
             return
         
-        # Generate Telegraf configuration
-        config = []
-        
-        # Add agent section
-        config.append("""# Telegraf Configuration for OPC UA Monitoring
+        # The config is streamed to a temporary file next to the output file and only
+        # moved into place once complete, so a failure never leaves a partial config
+        temp_output_path = self.output_file_path + '.tmp'
+        try:
+            logger.info(f"Reading nodes from CSV file: {self.csv_file_path}")
+            with csvfile:
+                reader = csv.reader(csvfile)
+                header = next(reader, [])
+                
+                # Locate required columns once, from the header row
+                missing_columns = [key for key in ('NodeId', 'MQTTCustomName') if key not in header]
+                if missing_columns:
+                    logger.error(f"CSV file is missing required columns: {', '.join(missing_columns)}")
+                    return
+                render_rows = partial(self._render_rows,
+                                      node_id_index=header.index('NodeId'),
+                                      custom_name_index=header.index('MQTTCustomName'))
+                chunks = iter(lambda: list(itertools.islice(reader, _ROWS_PER_CHUNK)), [])
+                
+                # Generate Telegraf configuration in the same pass over the CSV, streaming
+                # each section straight to the output file. Only the MQTT output blocks
+                # are kept until the InfluxDB section has been written.
+                logger.info(f"Writing Telegraf configuration to {self.output_file_path}")
+                with open(temp_output_path, 'w', encoding='utf-8', newline='\n', buffering=1 << 20) as f:
+                    # Add agent section
+                    f.write("""# Telegraf Configuration for OPC UA Monitoring
 # Generated from CSV file
 
 ###############################################################################
@@ -172,9 +282,9 @@ class TelegrafConfigGenerator:
   hostname = ""
   omit_hostname = true
 """)
-        
-        # Add OPC UA input plugin
-        config.append(f"""
+                    
+                    # Add OPC UA input plugin
+                    f.write(f"""
 ###############################################################################
 #                            INPUT PLUGINS                                    #
 ###############################################################################
@@ -206,18 +316,22 @@ class TelegrafConfigGenerator:
 
   ## Node Configuration: Define the OPC UA nodes to read data from.
 """)
-        
-        # Add node configurations
-        for node in nodes:
-            config.append(f"""  [[inputs.opcua.nodes]]
-    name = "{node['mqtt_custom_name']}"
-    namespace = "{node['namespace']}"
-    identifier_type = "{node['identifier_type']}"
-    identifier = '''{node['identifier']}'''
-""")
-        
-        # Add InfluxDB output plugin
-        config.append(f"""              
+                    
+                    # Add node configurations; results arrive in chunk order,
+                    # so the output order matches the CSV
+                    mqtt_blocks = []
+                    for opcua_chunk, mqtt_chunk, nodes_processed, topics_sanitized in (
+                            self._render_chunks(chunks, render_rows)):
+                        f.writelines(opcua_chunk)
+                        mqtt_blocks.extend(mqtt_chunk)
+                        self._total_nodes_processed += nodes_processed
+                        self._topics_sanitized += topics_sanitized
+                    
+                    logger.info(f"Successfully processed {self._total_nodes_processed} nodes from CSV.")
+                    logger.info(f"Sanitized {self._topics_sanitized} MQTT topics with restricted characters.")
+                    
+                    # Add InfluxDB output plugin
+                    f.write(f"""              
 ###############################################################################
 #                            OUTPUT PLUGINS                                   #
 ###############################################################################
@@ -229,32 +343,21 @@ class TelegrafConfigGenerator:
   organization = "$DOCKER_INFLUXDB_INIT_ORG" # Replace with your InfluxDB Org or env var
   bucket = "OPC UA"
 """)
-        
-        # Add MQTT output plugins for each node
-        config.append("""
+                    
+                    # Add MQTT output plugins for each node
+                    f.write("""
 # --- MQTT Outputs: One per Node (Filtering on 'id' tag) ---
 """)
-        
-        for node in nodes:
-            config.append(f'''# MQTT Output for Node: {node['identifier']}
-[[outputs.mqtt]]
-  servers = ["{self.mqtt_broker}"]
-  topic = "{node['mqtt_topic']}"
-  tagpass = {{ id = ["ns={node['namespace']};s={node['identifier']}"] }}
-  qos = 0
-  retain = false
-  data_format = "template"
-  template = "{{{{ .Field \\"{node['mqtt_custom_name']}\\" }}}}"
-''')
-        
-        # Write configuration to file
-        try:
-            logger.info(f"Writing Telegraf configuration to {self.output_file_path}")
-            with open(self.output_file_path, 'w', encoding='utf-8') as f:
-                f.write(''.join(config))
+                    
+                    f.writelines(mqtt_blocks)
+            os.replace(temp_output_path, self.output_file_path)
             logger.info(f"Configuration successfully written to {self.output_file_path}")
         except Exception as e:
-            logger.error(f"Error writing configuration file: {e}", exc_info=True)
+            logger.error(f"Error generating Telegraf configuration: {e}", exc_info=True)
+            try:
+                os.remove(temp_output_path)
+            except FileNotFoundError:
+                pass
     
     def run(self) -> None:
         """
@@ -290,6 +393,7 @@ def main():
     HARDCODED_MQTT_BROKER = "tcp://mosquitto:1883"  # MQTT broker URL
     HARDCODED_OPCUA_ENDPOINT = "opc.tcp://100.94.111.58:4841"  # OPC UA server endpoint
     HARDCODED_INFLUXDB_URL = "http://64.226.126.250:8086"      # InfluxDB URL
+    HARDCODED_WORKERS = 1                           # Worker processes for rendering nodes (1 = no multiprocessing)
     HARDCODED_LOGLEVEL = 'INFO'                     # Logging level (DEBUG, INFO, WARNING, ERROR, CRITICAL)
     # --- END OF HARDCODED VALUES ---
 
@@ -308,6 +412,7 @@ def main():
     logger.info(f"MQTT Broker: {HARDCODED_MQTT_BROKER}")
     logger.info(f"OPC UA Endpoint: {HARDCODED_OPCUA_ENDPOINT}")
     logger.info(f"InfluxDB URL: {HARDCODED_INFLUXDB_URL}")
+    logger.info(f"Workers: {HARDCODED_WORKERS}")
 
     try:
         # Create the generator instance with the hardcoded values
@@ -316,7 +421,8 @@ def main():
             output_file_path=HARDCODED_OUTPUT_FILE,
             mqtt_broker=HARDCODED_MQTT_BROKER,
             opcua_endpoint=HARDCODED_OPCUA_ENDPOINT,
-            influxdb_url=HARDCODED_INFLUXDB_URL
+            influxdb_url=HARDCODED_INFLUXDB_URL,
+            workers=HARDCODED_WORKERS
         )
         # Run the generator's main logic
         generator.run()